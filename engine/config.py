@@ -1,21 +1,25 @@
 
 from __future__ import annotations
-from typing import Dict, Any, Optional, List, Literal
-from pydantic import BaseModel, Field, HttpUrl, validator
+from typing import Callable, Dict, Any, Optional, List, Literal, Tuple
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, field_validator
+
+class _Model(BaseModel):
+    # Validated configs are immutable and reject unknown keys (catches typos in YAML)
+    model_config = ConfigDict(frozen=True, extra="forbid")
 
 InputFormat = Literal["json", "xml"]
 
 ResponseSource = Literal["status", "header", "json", "xml"]
 
-class ResponseField(BaseModel):
+class ResponseField(_Model):
     name: str
     source: ResponseSource = "json"
     expr: Optional[str] = None
 
-class ResponseSpec(BaseModel):
+class ResponseSpec(_Model):
     fields: List[ResponseField]
 
-class AuthConfig(BaseModel):
+class AuthConfig(_Model):
     type: Literal["none", "basic", "bearer", "api_key"] = "none"
     username: Optional[str] = None
     password: Optional[str] = None
@@ -24,30 +28,34 @@ class AuthConfig(BaseModel):
     query_param: Optional[str] = None
     value: Optional[str] = None
 
-class RequestSpec(BaseModel):
+class RequestSpec(_Model):
     method: Literal["GET","POST"] = "GET"
     url: str
     headers: Dict[str, str] = Field(default_factory=dict)
     params: Dict[str, Any] = Field(default_factory=dict)
     body: Optional[Dict[str, Any]] = None
     timeout_seconds: float = 30.0
+    # Filled lazily by the HTTP client: compiled Jinja2 templates and the
+    # (auth, merged headers, basic-auth tuple) that stay fixed per source.
+    _templates: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+    _static: Optional[Tuple[Any, Dict[str, str], Optional[Tuple[str, str]]]] = PrivateAttr(default=None)
 
-class MappingField(BaseModel):
+class MappingField(_Model):
     # For JSON use JMESPath; for XML use XPath.
     name: str
     expr: str
 
-class MappingSpec(BaseModel):
+class MappingSpec(_Model):
     # Either specify a "root" iterable (JMES/xpath for arrays), or leave None and map scalar fields.
     root: Optional[str] = None
     fields: List[MappingField]
 
-class SinkSpec(BaseModel):
+class SinkSpec(_Model):
     type: Literal["ndjson","csv"] = "ndjson"
     path: str
     mode: Literal["overwrite","append"] = "overwrite"
 
-class SourceConfig(BaseModel):
+class SourceConfig(_Model):
     name: str
     mls_id: int
     input_format: InputFormat
@@ -56,12 +64,37 @@ class SourceConfig(BaseModel):
     mapping: MappingSpec
     response: Optional[ResponseSpec] = None
     sink: SinkSpec
-    paginate: Optional[Dict[str, Any]] = None  # e.g., {"type":"page","param":"page","start":1,"limit":100, "max_pages":10}
+    paginate: Optional[Dict[str, Any]] = None  # e.g., {"type":"page","param":"page","start":1,"limit":100, "max_pages":10, "concurrency":8}
+
+    def make_sender(self) -> Callable[[Dict[str, Any]], Any]:
+        """Return a request function specialized for this source; call it with the page context."""
+        # imported here: http_client depends on this module
+        from .http_client import make_sender
+        return make_sender(self.request, self.auth)
 
-class AppConfig(BaseModel):
+class AppConfig(_Model):
     sources: List[SourceConfig]
+    # Built once after validation: sources by mls_id and the fallback source
+    # (mls_id 0, then a source named "default", then the first source).
+    _by_mls: Dict[int, SourceConfig] = PrivateAttr(default_factory=dict)
+    _default: Optional[SourceConfig] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._by_mls = {s.mls_id: s for s in self.sources}
+        default = self._by_mls.get(0)
+        if default is None:
+            default = next((s for s in self.sources if s.name.lower() == "default"), None)
+        if default is None and self.sources:
+            default = self.sources[0]
+        self._default = default
+
+    def source_for(self, mls: int) -> Optional[SourceConfig]:
+        """Return the source for mls, else the fallback source (None if there are no sources)."""
+        src = self._by_mls.get(mls)
+        return self._default if src is None else src
 
-    @validator("sources")
+    @field_validator("sources")
+    @classmethod
     def ensure_unique_mls(cls, v: List[SourceConfig]):
         seen = set()
         for s in v:
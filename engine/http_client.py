@@ -1,12 +1,159 @@
 
 from __future__ import annotations
 import httpx
-from typing import Dict, Any, Optional
-import json
-from datetime import datetime
+import atexit
+import contextlib
+import functools
+import http.cookiejar
+import io
+import logging
+import os
+import threading
+from typing import Callable, Dict, Any, Iterator, List, Optional, Set, Tuple
+import orjson
+import time
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from .config import AuthConfig, RequestSpec
-from jinja2 import Template
+from jinja2 import Environment, Template
+try:
+    # h2 is optional; HTTP/2 is only enabled on the shared client when available
+    import h2  # noqa: F401
+    _HTTP2 = True
+except Exception:  # pragma: no cover - optional dependency
+    _HTTP2 = False
+
+LOG = logging.getLogger(__name__)
+
+# One pooled client for the whole process so pages reuse keep-alive connections
+# instead of paying a fresh TCP+TLS handshake per request. Its cookie jar
+# accepts nothing: the client is shared by every source and job, and a cookie
+# set for one tenant must not be sent with another's requests.
+_CLIENT = httpx.Client(
+    http2=_HTTP2,
+    cookies=http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[])),
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+    timeout=httpx.Timeout(30.0),
+)
+atexit.register(_CLIENT.close)
+
+# Shared environment; templates are compiled once per distinct source string.
+_ENV = Environment(autoescape=False, cache_size=1000)
+
+@functools.lru_cache(maxsize=4096)
+def _compile(src: str) -> Template:
+    return _ENV.from_string(src)
+
+def _is_template(s: str) -> bool:
+    # Constant strings (most headers/params/URLs) never need to go through Jinja
+    return "{{" in s or "{%" in s or "{#" in s
+
+# Request/response logs are appended through long-lived buffered handles, one
+# per log path, instead of an open/write/close per request. A handle is flushed
+# once LOG_FLUSH_BYTES have accumulated, and a background timer flushes and
+# fsyncs the handles written to every LOG_FLUSH_INTERVAL_SECONDS. Handles not
+# written to for a whole interval are closed, so a log file per job does not
+# keep a descriptor open for the life of the process.
+LOG_FLUSH_BYTES = 256 * 1024
+LOG_FLUSH_INTERVAL_SECONDS = 2.0
+
+_LOG_LOCK = threading.Lock()
+# Serializes fsync and close of handles; both run without _LOG_LOCK so threads
+# writing logs never wait on the disk.
+_LOG_SYNC_LOCK = threading.Lock()
+_LOG_WRITERS: Dict[str, io.BufferedWriter] = {}
+_LOG_PENDING: Dict[str, int] = {}
+# paths written to since their last fsync
+_LOG_DIRTY: Set[str] = set()
+_LOG_TIMER: Optional[threading.Timer] = None
+
+def _log_writer(path: str) -> io.BufferedWriter:
+    # Caller holds _LOG_LOCK
+    f = _LOG_WRITERS.get(path)
+    if f is None:
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        f = open(path, "ab", buffering=1 << 20)
+        _LOG_WRITERS[path] = f
+        _LOG_PENDING[path] = 0
+    return f
+
+def _arm_log_timer() -> None:
+    # Caller holds _LOG_LOCK
+    global _LOG_TIMER
+    if _LOG_TIMER is None:
+        _LOG_TIMER = threading.Timer(LOG_FLUSH_INTERVAL_SECONDS, _flush_tick)
+        _LOG_TIMER.daemon = True
+        _LOG_TIMER.start()
+
+def _write_log(path: str, data: bytes) -> None:
+    with _LOG_LOCK:
+        f = _log_writer(path)
+        f.write(data)
+        _LOG_DIRTY.add(path)
+        _LOG_PENDING[path] += len(data)
+        if _LOG_PENDING[path] >= LOG_FLUSH_BYTES:
+            f.flush()
+            _LOG_PENDING[path] = 0
+        _arm_log_timer()
+
+def _flush_tick() -> None:
+    global _LOG_TIMER
+    with _LOG_LOCK:
+        _LOG_TIMER = None
+        idle = [path for path in _LOG_WRITERS if path not in _LOG_DIRTY]
+        stale = [_LOG_WRITERS.pop(path) for path in idle]
+        for path in idle:
+            del _LOG_PENDING[path]
+    flush_logs()
+    with _LOG_SYNC_LOCK:
+        for f in stale:
+            f.close()
+    with _LOG_LOCK:
+        # keep ticking while handles are open so idle ones get closed
+        if _LOG_WRITERS:
+            _arm_log_timer()
+
+def flush_logs() -> None:
+    """Flush and fsync the buffered request/response logs written since the last sync."""
+    with _LOG_LOCK:
+        dirty = [_LOG_WRITERS[path] for path in _LOG_DIRTY if path in _LOG_WRITERS]
+        for path in _LOG_DIRTY:
+            if path in _LOG_PENDING:
+                _LOG_PENDING[path] = 0
+        _LOG_DIRTY.clear()
+        for f in dirty:
+            f.flush()
+    with _LOG_SYNC_LOCK:
+        for f in dirty:
+            if not f.closed:
+                os.fsync(f.fileno())
+
+def _close_logs() -> None:
+    flush_logs()
+    with _LOG_LOCK:
+        handles = list(_LOG_WRITERS.values())
+        _LOG_WRITERS.clear()
+        _LOG_PENDING.clear()
+    with _LOG_SYNC_LOCK:
+        for f in handles:
+            f.close()
+
+atexit.register(_close_logs)
+
+# (epoch second, formatted "YYYY-MM-DDTHH:MM:SS") reused by every timestamp in that second
+_TS_CACHE = (-1, "")
+
+def _now_iso() -> str:
+    # UTC ISO-8601 with millisecond precision and a "Z" suffix, without building a datetime
+    global _TS_CACHE
+    now = time.time()
+    sec = int(now)
+    cached_sec, prefix = _TS_CACHE
+    if sec != cached_sec:
+        prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec))
+        _TS_CACHE = (sec, prefix)
+    return f"{prefix}.{int((now - sec) * 1000):03d}Z"
 
 def build_auth_headers(auth: AuthConfig) -> Dict[str,str]:
     if auth.type == "none":
@@ -20,87 +167,260 @@ def build_auth_headers(auth: AuthConfig) -> Dict[str,str]:
         return {auth.header: auth.value}
     return {}
 
-def format_with_jinja(template_obj: Any, context: Dict[str, Any]) -> Any:
-    # Recursively render strings with Jinja2
+def _unchanged(src: Any, out: Any, pairs) -> Any:
+    # Hand back the original container when no child was re-rendered
+    return src if all(new is old for new, old in pairs) else out
+
+def compile_templates(template_obj: Any) -> Any:
+    # Recursively replace strings with compiled Jinja2 templates
     if isinstance(template_obj, dict):
-        return {k: format_with_jinja(v, context) for k, v in template_obj.items()}
+        return {k: compile_templates(v) for k, v in template_obj.items()}
     if isinstance(template_obj, list):
-        return [format_with_jinja(x, context) for x in template_obj]
-    if isinstance(template_obj, str):
-        return Template(template_obj).render(**context)
+        return [compile_templates(x) for x in template_obj]
+    if isinstance(template_obj, str) and _is_template(template_obj):
+        return _compile(template_obj)
     return template_obj
 
-@retry(
+def _render_dict(o: Dict[str, Any], context: Dict[str, Any]) -> Any:
+    out = {k: render_templates(v, context) for k, v in o.items()}
+    return _unchanged(o, out, zip(out.values(), o.values()))
+
+def _render_list(o: List[Any], context: Dict[str, Any]) -> Any:
+    out = [render_templates(x, context) for x in o]
+    return _unchanged(o, out, zip(out, o))
+
+def _render_template(o: Template, context: Dict[str, Any]) -> str:
+    return o.render(context)
+
+_RENDER_DISPATCH = {dict: _render_dict, list: _render_list, Template: _render_template}
+
+def render_templates(compiled: Any, context: Dict[str, Any]) -> Any:
+    # Render a tree produced by compile_templates
+    fn = _RENDER_DISPATCH.get(type(compiled))
+    return fn(compiled, context) if fn else compiled
+
+def format_with_jinja(template_obj: Any, context: Dict[str, Any]) -> Any:
+    # Recursively render strings with Jinja2 (one-off form of compile + render)
+    return render_templates(compile_templates(template_obj), context)
+
+def _is_dynamic(compiled: Any) -> bool:
+    if type(compiled) is dict:
+        return any(_is_dynamic(v) for v in compiled.values())
+    if type(compiled) is list:
+        return any(_is_dynamic(x) for x in compiled)
+    return type(compiled) is Template
+
+def _request_templates(spec: RequestSpec) -> Dict[str, Any]:
+    # Compile once per spec and stash the tree on it, so later pages skip even the cache lookup.
+    # Only parts that actually contain templates are kept; constant parts are used as-is.
+    if spec._templates is None:
+        parts = {"url": spec.url, "params": spec.params, "body": spec.body}
+        compiled = {name: compile_templates(value) for name, value in parts.items()}
+        spec._templates = {name: tree for name, tree in compiled.items() if _is_dynamic(tree)}
+    return spec._templates
+
+def _static_parts(spec: RequestSpec, auth: AuthConfig) -> Tuple[Dict[str, str], Optional[Tuple[str, str]]]:
+    # Merged headers and basic-auth credentials are fixed for a source; build them once per spec
+    cached = spec._static
+    if cached is None or cached[0] is not auth:
+        headers = {**spec.headers, **build_auth_headers(auth)}
+        auth_tuple = None
+        if auth.type == "basic" and auth.username and auth.password:
+            auth_tuple = (auth.username, auth.password)
+        cached = spec._static = (auth, headers, auth_tuple)
+    return cached[1], cached[2]
+
+# Retry policy shared by send, make_sender and fetch_stream
+_RETRY_POLICY = dict(
     reraise=True,
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=0.5, min=1, max=10),
     retry=retry_if_exception_type((httpx.ConnectError, httpx.ReadTimeout, httpx.RemoteProtocolError))
 )
-def send(spec: RequestSpec, auth: AuthConfig, context: Dict[str, Any]) -> httpx.Response:
-    headers = {**spec.headers, **build_auth_headers(auth)}
-    params = format_with_jinja(spec.params, context)
-    url = format_with_jinja(spec.url, context)
-    body = format_with_jinja(spec.body, context) if spec.body else None
 
-    auth_tuple = None
-    if auth.type == "basic" and auth.username and auth.password:
-        auth_tuple = (auth.username, auth.password)
+def _prepare(spec: RequestSpec, auth: AuthConfig, context: Dict[str, Any]) -> Dict[str, Any]:
+    headers, auth_tuple = _static_parts(spec, auth)
+    templates = _request_templates(spec)
+    params = render_templates(templates["params"], context) if "params" in templates else spec.params
+    url = render_templates(templates["url"], context) if "url" in templates else spec.url
+    body = None
+    if spec.body:
+        body = render_templates(templates["body"], context) if "body" in templates else spec.body
 
-    log_file = context.get("log_file") if context else None
+    return {
+        "method": spec.method,
+        "url": url,
+        "headers": headers,
+        "params": params,
+        "body": body,
+        "auth": auth_tuple,
+    }
 
+def _request_record(req: Dict[str, Any]) -> Dict[str, Any]:
     # Prepare request record for logging (don't block execution on logging errors)
-    request_record = {
-        "timestamp": datetime.utcnow().isoformat() + "Z",
+    return {
+        "timestamp": _now_iso(),
         "request": {
-            "method": spec.method,
-            "url": url,
-            "headers": headers,
-            "params": params,
-            "body": body,
+            "method": req["method"],
+            "url": req["url"],
+            "headers": req["headers"],
+            "params": req["params"],
+            "body": req["body"],
         }
     }
 
-    with httpx.Client(timeout=spec.timeout_seconds) as client:
-        if spec.method == "GET":
-            if auth_tuple:
-                resp = client.get(url, headers=headers, params=params, auth=auth_tuple)
-            else:
-                resp = client.get(url, headers=headers, params=params)
-        else:
-            if auth_tuple:
-                resp = client.post(url, headers=headers, params=params, json=body, auth=auth_tuple)
-            else:
-                resp = client.post(url, headers=headers, params=params, json=body)
-
+def _log_exchange(log_file: str, request_record: Dict[str, Any], resp: httpx.Response) -> None:
     # Log response details (append JSON lines)
-    if log_file:
+    try:
+        resp_text = None
         try:
-            resp_text = None
-            try:
-                resp_text = resp.text
-            except Exception:
-                # fallback to bytes -> decode
-                resp_text = resp.content.decode("utf-8", errors="replace")
-
-            response_record = {
-                "timestamp": datetime.utcnow().isoformat() + "Z",
-                "response": {
-                    "status_code": resp.status_code,
-                    "headers": dict(resp.headers),
-                    "body": resp_text,
-                }
+            resp_text = resp.text
+        except (LookupError, ValueError):
+            # unknown/invalid charset: fallback to bytes -> decode
+            resp_text = resp.content.decode("utf-8", errors="replace")
+
+        response_record = {
+            "timestamp": _now_iso(),
+            "response": {
+                "status_code": resp.status_code,
+                "headers": dict(resp.headers),
+                "body": resp_text,
             }
+        }
 
-            # Merge request and response into single entry for easier tracing
-            entry = {**request_record, **response_record}
-            import os
-            parent = os.path.dirname(log_file)
-            if parent:
-                os.makedirs(parent, exist_ok=True)
-            with open(log_file, "a", encoding="utf-8") as lf:
-                lf.write(json.dumps(entry, ensure_ascii=False) + "\n")
-        except Exception:
-            # Never allow logging failures to break the request flow
-            pass
+        # Merge request and response into single entry for easier tracing
+        entry = {**request_record, **response_record}
+        _write_log(log_file, orjson.dumps(entry, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE))
+    except (OSError, UnicodeDecodeError, TypeError):
+        # Never allow logging failures to break the request flow
+        LOG.warning("Failed to write request log %s", log_file, exc_info=True)
 
+@retry(**_RETRY_POLICY)
+def send(spec: RequestSpec, auth: AuthConfig, context: Dict[str, Any]) -> httpx.Response:
+    req = _prepare(spec, auth, context)
+    log_file = context.get("log_file") if context else None
+    request_record = _request_record(req)
+
+    if spec.method == "GET":
+        resp = _CLIENT.get(req["url"], headers=req["headers"], params=req["params"], auth=req["auth"], timeout=spec.timeout_seconds)
+    else:
+        resp = _CLIENT.post(req["url"], headers=req["headers"], params=req["params"], json=req["body"], auth=req["auth"], timeout=spec.timeout_seconds)
+
+    if log_file:
+        _log_exchange(log_file, request_record, resp)
     return resp
+
+def make_sender(spec: RequestSpec, auth: AuthConfig) -> Callable[[Dict[str, Any]], httpx.Response]:
+    """Build a send() specialized for one source.
+
+    Templates, merged headers, basic-auth credentials and the client method
+    are resolved once here, so each call only renders the dynamic parts and
+    issues the request. The returned function is retried like send().
+    """
+    headers, auth_tuple = _static_parts(spec, auth)
+    templates = _request_templates(spec)
+    url_t, params_t, body_t = templates.get("url"), templates.get("params"), templates.get("body")
+    const_body = spec.body or None
+    method, timeout = spec.method, spec.timeout_seconds
+
+    if method == "GET":
+        client_get = _CLIENT.get
+
+        def issue(url: str, params: Any, body: Any) -> httpx.Response:
+            return client_get(url, headers=headers, params=params, auth=auth_tuple, timeout=timeout)
+    else:
+        client_post = _CLIENT.post
+
+        def issue(url: str, params: Any, body: Any) -> httpx.Response:
+            return client_post(url, headers=headers, params=params, json=body, auth=auth_tuple, timeout=timeout)
+
+    @retry(**_RETRY_POLICY)
+    def sender(context: Dict[str, Any]) -> httpx.Response:
+        url = spec.url if url_t is None else render_templates(url_t, context)
+        params = spec.params if params_t is None else render_templates(params_t, context)
+        body = const_body if body_t is None else render_templates(body_t, context)
+
+        log_file = context.get("log_file") if context else None
+        if not log_file:
+            return issue(url, params, body)
+
+        request_record = _request_record(
+            {"method": method, "url": url, "headers": headers, "params": params, "body": body}
+        )
+        resp = issue(url, params, body)
+        _log_exchange(log_file, request_record, resp)
+        return resp
+
+    return sender
+
+def _open_stream(spec: RequestSpec, req: Dict[str, Any]) -> httpx.Response:
+    request = _CLIENT.build_request(
+        spec.method,
+        req["url"],
+        headers=req["headers"],
+        params=req["params"],
+        json=req["body"] if spec.method == "POST" else None,
+        timeout=spec.timeout_seconds,
+    )
+    return _CLIENT.send(request, auth=req["auth"], stream=True)
+
+@contextlib.contextmanager
+def send_stream(spec: RequestSpec, auth: AuthConfig, context: Dict[str, Any]) -> Iterator[httpx.Response]:
+    """Like send(), but the body is not read up front.
+
+    Consume it with resp.iter_bytes() inside the with-block. Successful
+    responses are logged with status, headers and byte count only; error
+    bodies are read and logged in full. Nothing is retried here, since the
+    body is read by the caller; use fetch_stream() for a retried fetch.
+    """
+    req = _prepare(spec, auth, context)
+    log_file = context.get("log_file") if context else None
+    request_record = _request_record(req)
+    resp = _open_stream(spec, req)
+    try:
+        yield resp
+    finally:
+        try:
+            if log_file:
+                body_read = False
+                if resp.is_error:
+                    # error bodies are small and worth keeping; read whatever is left
+                    try:
+                        resp.read()
+                        body_read = True
+                    except (httpx.StreamError, httpx.HTTPError):
+                        pass
+                if body_read:
+                    _log_exchange(log_file, request_record, resp)
+                else:
+                    _log_stream(log_file, request_record, resp)
+        finally:
+            resp.close()
+
+@retry(**_RETRY_POLICY)
+def fetch_stream(spec: RequestSpec, auth: AuthConfig, context: Dict[str, Any], consume: Callable[[Iterator[bytes]], Any]) -> Tuple[Any, httpx.Response]:
+    """Stream a response body into consume(chunks) and return (its result, response).
+
+    The request and the whole body read are retried together, so a connection
+    dropped mid-body starts the page over like send() does. consume must not
+    keep state between calls. Error statuses raise httpx.HTTPStatusError.
+    """
+    with send_stream(spec, auth, context) as resp:
+        resp.raise_for_status()
+        return consume(resp.iter_bytes()), resp
+
+def _log_stream(log_file: str, request_record: Dict[str, Any], resp: httpx.Response) -> None:
+    try:
+        response_record = {
+            "timestamp": _now_iso(),
+            "response": {
+                "status_code": resp.status_code,
+                "headers": dict(resp.headers),
+                "body_bytes": resp.num_bytes_downloaded,
+            }
+        }
+        entry = {**request_record, **response_record}
+        _write_log(log_file, orjson.dumps(entry, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE))
+    except (OSError, UnicodeDecodeError, TypeError):
+        # Never allow logging failures to break the request flow
+        LOG.warning("Failed to write request log %s", log_file, exc_info=True)
@@ -1,47 +1,187 @@
 
 from __future__ import annotations
-from typing import Any, Dict, Iterable, List
+import functools
+import re
+import threading
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
 import jmespath
 from lxml import etree
+import ijson
 from .config import MappingSpec
 
+class StreamMappingError(ValueError):
+    """A body could not be mapped while streaming; parse it whole instead."""
+
+@functools.lru_cache(maxsize=2048)
+def compile_jmes(expr: str) -> jmespath.parser.ParsedResult:
+    """Return the compiled JMESPath expression, cached per expression string."""
+    return jmespath.compile(expr)
+
 def map_json(doc: Any, mapping: MappingSpec) -> List[Dict[str, Any]]:
     if mapping.root:
-        items = jmespath.search(mapping.root, doc) or []
+        items = compile_jmes(mapping.root).search(doc) or []
     else:
         items = [doc]
+    # Parse each expression once, not once per item
+    compiled = [(f.name, compile_jmes(f.expr)) for f in mapping.fields]
+    return [{name: expr.search(it) for name, expr in compiled} for it in items]
+
+# JMESPath roots made of plain dotted identifiers (e.g. "data.items") map directly
+# onto an ijson prefix, so array items can be mapped as they arrive.
+_STREAMABLE_JMES_ROOT = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*")
+
+def _map_json_stream(chunks: Iterable[bytes], mapping: MappingSpec) -> List[Dict[str, Any]]:
+    compiled = [(f.name, compile_jmes(f.expr)) for f in mapping.fields]
+    items = ijson.sendable_list()
+    coro = ijson.items_coro(items, mapping.root + ".item", use_float=True)
     out: List[Dict[str, Any]] = []
-    for it in items:
-        row = {}
-        for f in mapping.fields:
-            row[f.name] = jmespath.search(f.expr, it)
-        out.append(row)
+    try:
+        for chunk in chunks:
+            coro.send(chunk)
+            out.extend({name: expr.search(it) for name, expr in compiled} for it in items)
+            del items[:]
+        coro.close()
+    except ijson.JSONError as exc:
+        # ijson's C backend rejects some bodies orjson accepts (integers beyond
+        # int64 overflow); let the caller fall back to a whole-body parse
+        raise StreamMappingError(str(exc)) from exc
+    out.extend({name: expr.search(it) for name, expr in compiled} for it in items)
     return out
 
+# lxml parsers must not be used from several threads at once, so each thread
+# keeps its own. huge_tree lifts libxml2's limits on nesting depth and text
+# node size, which large listing feeds can exceed.
+_PARSERS = threading.local()
+
+def _xml_parser() -> etree.XMLParser:
+    parser = getattr(_PARSERS, "parser", None)
+    if parser is None:
+        parser = _PARSERS.parser = etree.XMLParser(huge_tree=True)
+    return parser
+
+def parse_xml(xml_bytes: bytes):
+    """Parse a complete XML document and return its root element."""
+    return etree.fromstring(xml_bytes, _xml_parser())
+
+@functools.lru_cache(maxsize=2048)
+def compile_xpath(expr: str, namespaces: FrozenSet[Tuple[Optional[str], str]]) -> etree.XPath:
+    """Return the compiled XPath, cached per expression and namespace map
+    (given as frozenset(nsmap.items()))."""
+    # Plain strings: smart strings keep a reference to their element (and tree)
+    return etree.XPath(expr, namespaces=dict(namespaces), smart_strings=False)
+
+# Root selectors made of plain element names (e.g. "//results/Agent") can be
+# matched while the document is parsed, so the full tree is never built.
+_STREAMABLE_ROOT = re.compile(r"//[A-Za-z_][\w.-]*(?:/[A-Za-z_][\w.-]*)*")
+# Field expressions that look outside the current item (absolute paths, parent
+# or explicit axes) need the whole tree and disable streaming.
+_NON_LOCAL_EXPR = re.compile(r"(?:^|[\s(,|=<>\[])/|\.\.|::")
+
+def _stream_steps(mapping: MappingSpec) -> Optional[List[str]]:
+    if not mapping.root or not _STREAMABLE_ROOT.fullmatch(mapping.root):
+        return None
+    if any(_NON_LOCAL_EXPR.search(f.expr) for f in mapping.fields):
+        return None
+    return mapping.root[2:].split("/")
+
 def map_xml(xml_bytes: bytes, mapping: MappingSpec) -> List[Dict[str, Any]]:
-    root = etree.fromstring(xml_bytes)
-    nsmap = root.nsmap
+    steps = _stream_steps(mapping)
+    if steps is not None:
+        return _map_xml_stream([xml_bytes], mapping, steps)
+
+    return map_xml_tree(parse_xml(xml_bytes), mapping)
+
+def map_xml_tree(root, mapping: MappingSpec) -> List[Dict[str, Any]]:
+    """Map an already parsed XML document (its root element)."""
+    ns = frozenset(root.nsmap.items())
     if mapping.root:
-        items = root.xpath(mapping.root, namespaces=nsmap)
+        items = compile_xpath(mapping.root, ns)(root)
     else:
         items = [root]
+    # Compile each expression once (and across pages sharing the same namespaces)
+    compiled = [(f.name, compile_xpath(f.expr, ns)) for f in mapping.fields]
+    return [_xml_row(el, compiled) for el in items]
+
+def stream_mapper(mapping: MappingSpec, input_format: str) -> Optional[Callable[[Iterable[bytes]], List[Dict[str, Any]]]]:
+    """Return a function that maps a response body given as byte chunks, or
+    None when this mapping needs the whole document in memory."""
+    if input_format == "json":
+        if not mapping.root or not _STREAMABLE_JMES_ROOT.fullmatch(mapping.root):
+            return None
+        return lambda chunks: _map_json_stream(chunks, mapping)
+    steps = _stream_steps(mapping)
+    if steps is None:
+        return None
+    return lambda chunks: _map_xml_stream(chunks, mapping, steps)
+
+def _map_xml_stream(chunks: Iterable[bytes], mapping: MappingSpec, steps: List[str]) -> List[Dict[str, Any]]:
+    # Single pass over the document: rows are extracted as each item element
+    # closes, then the element and its already-seen siblings are dropped so
+    # memory stays bounded by one item rather than the whole document.
+    parser = etree.XMLPullParser(events=("start", "end"), tag=steps[-1], huge_tree=True)
+    compiled: Optional[List[Tuple[str, etree.XPath]]] = None
     out: List[Dict[str, Any]] = []
-    for el in items:
-        row = {}
-        for f in mapping.fields:
-            val = el.xpath(f.expr, namespaces=nsmap)
-            if isinstance(val, list):
-                if len(val) == 0:
-                    row[f.name] = None
-                elif len(val) == 1:
-                    row[f.name] = _to_text(val[0])
-                else:
-                    row[f.name] = [_to_text(v) for v in val]
-            else:
-                row[f.name] = _to_text(val)
-        out.append(row)
+    # Row slots of the items currently open. A slot is reserved when an item
+    # starts so nested items keep document order; it is filled when it ends.
+    open_slots: List[int] = []
+
+    def drain() -> None:
+        nonlocal compiled
+        for event, el in parser.read_events():
+            if not _has_ancestors(el, steps[:-1]):
+                continue
+            if event == "start":
+                open_slots.append(len(out))
+                out.append({})
+                continue
+            if compiled is None:
+                ns = frozenset(el.getroottree().getroot().nsmap.items())
+                compiled = [(f.name, compile_xpath(f.expr, ns)) for f in mapping.fields]
+            out[open_slots.pop()] = _xml_row(el, compiled)
+            if open_slots:
+                # still inside an enclosing item, whose fields may read this subtree
+                continue
+            el.clear(keep_tail=True)
+            parent = el.getparent()
+            if parent is None:
+                # the item is the document root; its siblings are comments/PIs
+                continue
+            while el.getprevious() is not None:
+                del parent[0]
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        drain()
+    root = parser.close()
+    drain()
+    if root is not None and None in root.nsmap:
+        # Unprefixed names in the configured XPaths cannot address elements in
+        # a default namespace; fail as the tree path does rather than match nothing.
+        raise TypeError("empty namespace prefix is not supported in XPath")
     return out
 
+def _has_ancestors(el, tags: List[str]) -> bool:
+    for tag in reversed(tags):
+        el = el.getparent()
+        if el is None or el.tag != tag:
+            return False
+    return True
+
+def _xml_row(el, compiled: List[Tuple[str, etree.XPath]]) -> Dict[str, Any]:
+    row = {}
+    for name, xp in compiled:
+        val = xp(el)
+        if isinstance(val, list):
+            if len(val) == 0:
+                row[name] = None
+            elif len(val) == 1:
+                row[name] = _to_text(val[0])
+            else:
+                row[name] = [_to_text(v) for v in val]
+        else:
+            row[name] = _to_text(val)
+    return row
+
 def _to_text(x):
     if hasattr(x, "text"):
         return x.text
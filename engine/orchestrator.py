@@ -1,13 +1,17 @@
 from __future__ import annotations
 import os
-import json
+import orjson
 import logging
-import uuid
-from typing import Any, Dict, Optional
+import secrets
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 import time
 from datetime import datetime, timezone
 
-from azure.servicebus import ServiceBusClient, ServiceBusMessage
+from azure.core.exceptions import AzureError
+from azure.servicebus import AutoLockRenewer, ServiceBusClient, ServiceBusMessage, ServiceBusReceiveMode, ServiceBusSender
+from azure.servicebus.exceptions import ServiceBusError
 try:
     # azure.identity is optional in some test environments; import when available
     from azure.identity import DefaultAzureCredential
@@ -18,6 +22,16 @@ from .runner import run
 
 LOG = logging.getLogger(__name__)
 
+# Run summaries are buffered and sent as one message batch per output queue once
+# SUMMARY_BATCH_SIZE are pending or SUMMARY_FLUSH_SECONDS have passed.
+SUMMARY_BATCH_SIZE = 50
+SUMMARY_FLUSH_SECONDS = 2.0
+
+
+def _rid() -> str:
+    """Return a random 128-bit request id as 32 hex characters."""
+    return secrets.token_hex(16)
+
 
 class ServiceBusOrchestrator:
     """Listens to an Azure Service Bus queue and dispatches runner jobs.
@@ -42,6 +56,7 @@ class ServiceBusOrchestrator:
         output_queue: Optional[str] = None,
         listen_duration_seconds: Optional[int] = None,
         sb_fqdn: Optional[str] = None,
+        max_workers: Optional[int] = None,
     ):
         # connection string: arg overrides env
         self.connection_string = connection_string or os.environ.get("SERVICEBUS_CONNECTION_STRING")
@@ -59,11 +74,20 @@ class ServiceBusOrchestrator:
         if listen_duration_seconds is None and env_dur:
             try:
                 listen_duration_seconds = int(env_dur)
-            except Exception:
+            except ValueError:
                 listen_duration_seconds = None
 
         self.listen_duration_seconds = listen_duration_seconds
 
+        # How many messages are processed concurrently. Constructor arg overrides env.
+        env_workers = os.environ.get("MAX_WORKERS")
+        if max_workers is None and env_workers:
+            try:
+                max_workers = int(env_workers)
+            except ValueError:
+                max_workers = None
+        self.max_workers = max(1, max_workers or 4)
+
         if self.sb_fqdn:
             if DefaultAzureCredential is None:
                 raise RuntimeError("azure.identity is required for managed identity (SB_FQDN) but is not available")
@@ -76,16 +100,138 @@ class ServiceBusOrchestrator:
         if not self.connection_string and not self.sb_fqdn:
             raise ValueError("Either SERVICEBUS_CONNECTION_STRING or SB_FQDN (managed identity) must be provided")
 
-    def _parse_message_body(self, msg) -> Dict[str, Any]:
-        # msg.body may be an iterable of bytes/str parts
+        # Output clients/senders are opened on first use and kept for the lifetime
+        # of the listener, so each summary doesn't pay an AMQP handshake + auth.
+        self._out_lock = threading.Lock()
+        self._out_clients: Dict[Tuple[str, str], ServiceBusClient] = {}
+        self._out_senders: Dict[Tuple[str, str, str], ServiceBusSender] = {}
+
+        # Pending summaries keyed by (output queue, connection string or None for sb_fqdn)
+        self._summary_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._summary_batches: Dict[Tuple[str, Optional[str]], List[Dict[str, Any]]] = {}
+        self._summary_last_flush = time.monotonic()
+        self._summary_timer: Optional[threading.Timer] = None
+
+    def _sender_for(self, out_queue: str, conn_str: Optional[str] = None) -> ServiceBusSender:
+        """Return a cached sender for out_queue.
+
+        With conn_str None the managed-identity namespace (sb_fqdn) is used,
+        otherwise the given connection string.
+        """
+        client_key = ("fqdn", str(self.sb_fqdn)) if conn_str is None else ("conn", conn_str)
+        sender_key = (*client_key, out_queue)
+        with self._out_lock:
+            sender = self._out_senders.get(sender_key)
+            if sender is None:
+                client = self._out_clients.get(client_key)
+                if client is None:
+                    if conn_str is None:
+                        # credential was set in __init__ when sb_fqdn was provided
+                        assert self.credential is not None
+                        client = ServiceBusClient(str(self.sb_fqdn), credential=self.credential)
+                    else:
+                        client = ServiceBusClient.from_connection_string(conn_str)
+                    self._out_clients[client_key] = client
+                sender = client.get_queue_sender(queue_name=out_queue)
+                self._out_senders[sender_key] = sender
+            return sender
+
+    def _send_output(self, out_queue: str, conn_str: Optional[str], messages: List[ServiceBusMessage]) -> None:
+        sender = self._sender_for(out_queue, conn_str)
         try:
-            parts = [bytes(p) for p in msg.body]
-            raw = b"".join(parts).decode("utf-8")
+            # pack as many messages per batch as the broker's size limit allows
+            batch = sender.create_message_batch()
+            for m in messages:
+                try:
+                    batch.add_message(m)
+                except ValueError:
+                    sender.send_messages(batch)
+                    batch = sender.create_message_batch()
+                    batch.add_message(m)
+            sender.send_messages(batch)
         except Exception:
-            # fallback to str(msg)
-            raw = str(msg)
+            # drop the (possibly broken) sender so the next send reopens it
+            self._discard_sender(sender)
+            raise
+
+    def _discard_sender(self, sender: ServiceBusSender) -> None:
+        with self._out_lock:
+            for key, cached in list(self._out_senders.items()):
+                if cached is sender:
+                    del self._out_senders[key]
+        try:
+            sender.close()
+        except ServiceBusError:
+            LOG.warning("Failed to close output sender", exc_info=True)
+
+    def _queue_summary(self, out_queue: str, conn_str: Optional[str], summary: Dict[str, Any]) -> None:
+        with self._summary_lock:
+            batch = self._summary_batches.setdefault((out_queue, conn_str), [])
+            # kept as a dict; encoding happens once per batch in flush_summaries,
+            # which runs on the timer or on the worker that makes the batch due
+            batch.append(summary)
+            due = (
+                len(batch) >= SUMMARY_BATCH_SIZE
+                or time.monotonic() - self._summary_last_flush >= SUMMARY_FLUSH_SECONDS
+            )
+            if not due and self._summary_timer is None:
+                self._summary_timer = threading.Timer(SUMMARY_FLUSH_SECONDS, self._summary_tick)
+                self._summary_timer.daemon = True
+                self._summary_timer.start()
+        if due:
+            self.flush_summaries()
+
+    def _summary_tick(self) -> None:
+        with self._summary_lock:
+            self._summary_timer = None
+        self.flush_summaries()
+
+    def flush_summaries(self) -> None:
+        """Send all buffered run summaries, batched per output queue."""
+        # senders are not thread-safe; only one flush talks to them at a time
+        with self._flush_lock:
+            with self._summary_lock:
+                batches = self._summary_batches
+                self._summary_batches = {}
+                self._summary_last_flush = time.monotonic()
+            # A failed batch is logged and skipped: the flush runs on whichever
+            # worker queued the summary that made it due, and that job (whose
+            # own run already succeeded) must not be abandoned and rerun.
+            for (out_queue, conn_str), summaries in batches.items():
+                try:
+                    messages = [ServiceBusMessage(orjson.dumps(summary)) for summary in summaries]
+                    self._send_output(out_queue, conn_str, messages)
+                    LOG.info("Sent %d summary message(s) to output queue %s", len(messages), out_queue)
+                except (AzureError, ValueError, TypeError):
+                    # ServiceBusError or a credential failure while (re)connecting,
+                    # a malformed connection string, or an unserializable summary
+                    LOG.exception("Failed to send summary messages to output queue %s", out_queue)
+
+    def close_senders(self) -> None:
+        """Close all cached output senders and their clients."""
+        with self._out_lock:
+            senders = list(self._out_senders.values())
+            clients = list(self._out_clients.values())
+            self._out_senders.clear()
+            self._out_clients.clear()
+        for obj in senders + clients:
+            try:
+                obj.close()
+            except ServiceBusError:
+                LOG.warning("Failed to close Service Bus output connection", exc_info=True)
 
-        return json.loads(raw)
+    def _parse_message_body(self, msg) -> Dict[str, Any]:
+        # msg.body may be an iterable of bytes/str parts; accumulate them into a
+        # single buffer and let orjson parse the bytes directly
+        buf = bytearray()
+        try:
+            for p in msg.body:
+                buf += p if isinstance(p, (bytes, bytearray, memoryview)) else str(p).encode("utf-8")
+        except (TypeError, AttributeError):
+            # fallback to str(msg)
+            return orjson.loads(str(msg))
+        return orjson.loads(buf)
 
     def handle_message(self, payload: Dict[str, Any]) -> None:
         # Extract required params
@@ -95,7 +241,7 @@ class ServiceBusOrchestrator:
             raise ValueError("Message payload must include 'config' and 'mls' fields")
 
         # Ensure a request_id is present for correlation (generate if missing)
-        request_id = payload.get("request_id") or str(uuid.uuid4())
+        request_id = payload.get("request_id") or _rid()
 
         # Build context from payload, excluding config and mls, but include request_id
         context = {k: v for k, v in payload.items() if k not in ("config", "mls")}
@@ -104,7 +250,7 @@ class ServiceBusOrchestrator:
         # Ensure mls is int
         try:
             mls_int = int(mls)
-        except Exception:
+        except (TypeError, ValueError):
             raise ValueError("'mls' must be an integer")
 
         LOG.info("Dispatching runner request_id=%s mls=%s config=%s", request_id, mls_int, cfg)
@@ -131,27 +277,16 @@ class ServiceBusOrchestrator:
                 "sample": metadata.get("sample"),
                 "response_fields": metadata.get("response_fields"),
             }
-            try:
-                # ensure we have a connection string to use
-                    if not out_conn and not self.sb_fqdn:
-                        LOG.warning("No connection string available to send summary to %s", out_queue)
-                    else:
-                        # prefer managed identity (sb_fqdn) when configured and no explicit out_conn
-                        if self.sb_fqdn and (out_conn is None or out_conn == self.connection_string):
-                            # credential was set in __init__ when sb_fqdn was provided
-                            assert self.credential is not None
-                            with ServiceBusClient(self.sb_fqdn, credential=self.credential) as client:
-                                with client.get_queue_sender(queue_name=out_queue) as sender:
-                                    sender.send_messages(ServiceBusMessage(json.dumps(summary)))
-                        else:
-                            # explicit connection string available; use it
-                            conn_str = str(out_conn or self.connection_string)
-                            with ServiceBusClient.from_connection_string(conn_str) as client:
-                                with client.get_queue_sender(queue_name=out_queue) as sender:
-                                    sender.send_messages(ServiceBusMessage(json.dumps(summary)))
-                        LOG.info("Sent summary message to output queue %s", out_queue)
-            except Exception:
-                LOG.exception("Failed to send summary message to output queue %s", out_queue)
+            # ensure we have a connection string to use
+            if not out_conn and not self.sb_fqdn:
+                LOG.warning("No connection string available to send summary to %s", out_queue)
+            else:
+                # prefer managed identity (sb_fqdn) when configured and no explicit out_conn
+                if self.sb_fqdn and (out_conn is None or out_conn == self.connection_string):
+                    self._queue_summary(out_queue, None, summary)
+                else:
+                    # explicit connection string available; use it
+                    self._queue_summary(out_queue, str(out_conn or self.connection_string), summary)
 
     def _send_warning_summary(self, reason: str, details: Optional[Dict[str, Any]] = None) -> None:
         """Send a warning message to the configured output queue.
@@ -170,28 +305,70 @@ class ServiceBusOrchestrator:
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "details": details or {},
         }
+        # send pending summaries first so none are lost or reordered behind the warning
+        self.flush_summaries()
         try:
-            # Prefer managed identity when sb_fqdn is configured
-            if self.sb_fqdn:
-                assert self.credential is not None
-                with ServiceBusClient(self.sb_fqdn, credential=self.credential) as client:
-                    with client.get_queue_sender(queue_name=out_queue) as sender:
-                        sender.send_messages(ServiceBusMessage(json.dumps(warning)))
-            else:
-                conn_str = str(out_conn)
-                with ServiceBusClient.from_connection_string(conn_str) as client:
-                    with client.get_queue_sender(queue_name=out_queue) as sender:
-                        sender.send_messages(ServiceBusMessage(json.dumps(warning)))
+            message = ServiceBusMessage(orjson.dumps(warning))
+            # senders are not thread-safe; share them only under the flush lock
+            with self._flush_lock:
+                # Prefer managed identity when sb_fqdn is configured
+                if self.sb_fqdn:
+                    self._send_output(out_queue, None, [message])
+                else:
+                    self._send_output(out_queue, str(out_conn), [message])
             LOG.info("Sent warning summary to output queue %s", out_queue)
-        except Exception:
+        except (AzureError, ValueError, TypeError):
             LOG.exception("Failed to send warning summary to output queue %s", out_queue)
 
-    def listen_queue(self, queue_name: Optional[str] = None, max_wait_time: int = 5, listen_duration_seconds: Optional[int] = None):
+    def _process_message(self, msg) -> None:
+        payload = self._parse_message_body(msg)
+        self.handle_message(payload)
+
+    def _settle_done(self, receiver, pending: Dict[Future, Any], receive_and_delete: bool) -> None:
+        # Settle on the listener thread: receivers must not be shared across threads.
+        for fut in [f for f in pending if f.done()]:
+            msg = pending.pop(fut)
+            exc = fut.exception()
+            if exc is None:
+                if not receive_and_delete:
+                    try:
+                        receiver.complete_message(msg)
+                    except ServiceBusError:
+                        LOG.exception("Failed to complete message")
+                continue
+            LOG.error("Failed to process message: %s", exc, exc_info=exc)
+            if receive_and_delete:
+                continue
+            try:
+                receiver.abandon_message(msg)
+            except ServiceBusError:
+                LOG.exception("Failed to abandon message")
+
+    def listen_queue(
+        self,
+        queue_name: Optional[str] = None,
+        max_wait_time: int = 5,
+        listen_duration_seconds: Optional[int] = None,
+        prefetch_count: int = 0,
+        batch_size: Optional[int] = None,
+        receive_and_delete: bool = False,
+    ):
         """Continuously listen to the given queue and process incoming messages.
 
+        Messages are run on a pool of max_workers threads so the listener keeps
+        receiving while jobs execute; locks of in-flight messages are renewed
+        automatically and messages are settled once their job finishes.
+
         If listen_duration_seconds is provided (or configured on the instance), the listener
         will stop after that many seconds. When stopped due to timeout a warning message
         will be sent to the output queue.
+        Up to batch_size (default max_workers) messages are received per call.
+        prefetch_count messages are buffered client-side; it defaults to 0
+        because prefetched messages are not lock-renewed while they wait, and
+        each message is a whole ingestion job: a lock that expires in the buffer
+        makes the message redeliver and its run repeat.
+        With receive_and_delete the broker removes messages on receipt, so no
+        settlement round-trip is made (and failed messages are not retried).
         This method blocks until interrupted or duration elapses.
         """
         # choose queue: explicit arg overrides configured input_queue
@@ -204,9 +381,11 @@ class ServiceBusOrchestrator:
         effective_duration = listen_duration_seconds if listen_duration_seconds is not None else self.listen_duration_seconds
         end_time = (time.time() + effective_duration) if effective_duration and effective_duration > 0 else None
 
-        # To ensure we process exactly one message at a time and avoid prefetching
-        # multiple messages into the client, set prefetch_count=0 and request
-        # a single message per receive call (max_message_count=1).
+        # Receive in batches so broker round-trips are amortized across
+        # messages instead of paid once per message.
+        if batch_size is None:
+            batch_size = self.max_workers
+        receive_mode = ServiceBusReceiveMode.RECEIVE_AND_DELETE if receive_and_delete else ServiceBusReceiveMode.PEEK_LOCK
         if self.sb_fqdn:
             assert self.credential is not None
             client_ctx = ServiceBusClient(self.sb_fqdn, credential=self.credential)
@@ -214,37 +393,60 @@ class ServiceBusOrchestrator:
             conn_str = str(self.connection_string)
             client_ctx = ServiceBusClient.from_connection_string(conn_str)
 
-        with client_ctx as client:
-            receiver = client.get_queue_receiver(queue_name=queue_name, max_wait_time=max_wait_time, prefetch_count=0)
-            with receiver:
-                while True:
-                    # check timeout
-                    if end_time is not None and time.time() >= end_time:
-                        LOG.info("Listen duration of %s seconds elapsed, stopping listener", effective_duration)
-                        # send a warning to the output queue with basic orchestrator info
-                        details = {"input_queue": queue_name, "listen_duration_seconds": effective_duration}
-                        self._send_warning_summary("listen_timeout", details=details)
-                        break
-
+        try:
+            with client_ctx as client:
+                receiver = client.get_queue_receiver(
+                    queue_name=queue_name,
+                    max_wait_time=max_wait_time,
+                    prefetch_count=prefetch_count,
+                    receive_mode=receive_mode,
+                )
+                # Bound in-flight work so the receive loop back-pressures when all workers are busy
+                slots = threading.BoundedSemaphore(self.max_workers)
+                pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="runner")
+                renewer = None if receive_and_delete else AutoLockRenewer(max_lock_renewal_duration=300)
+                pending: Dict[Future, Any] = {}
+                timeout_details: Optional[Dict[str, Any]] = None
+                with receiver:
                     try:
-                        # receive a single message and block for up to max_wait_time
-                        messages = receiver.receive_messages(max_message_count=1, max_wait_time=max_wait_time)
-                        for msg in messages:
+                        while True:
+                            # check timeout
+                            if end_time is not None and time.time() >= end_time:
+                                LOG.info("Listen duration of %s seconds elapsed, stopping listener", effective_duration)
+                                # the warning goes out once in-flight jobs have finished (below)
+                                timeout_details = {"input_queue": queue_name, "listen_duration_seconds": effective_duration}
+                                break
+
                             try:
-                                payload = self._parse_message_body(msg)
-                                self.handle_message(payload)
-                                receiver.complete_message(msg)
-                            except Exception as e:
-                                LOG.exception("Failed to process message: %s", e)
-                                try:
-                                    receiver.abandon_message(msg)
-                                except Exception:
-                                    LOG.exception("Failed to abandon message")
-                    except KeyboardInterrupt:
-                        LOG.info("Interrupted, stopping listener")
-                        break
-                    except Exception:
-                        LOG.exception("Error while receiving messages, continuing")
+                                # receive up to batch_size messages and block for up to max_wait_time
+                                messages = receiver.receive_messages(max_message_count=batch_size, max_wait_time=max_wait_time)
+                                for msg in messages:
+                                    if renewer is not None:
+                                        renewer.register(receiver, msg)
+                                    slots.acquire()
+                                    fut = pool.submit(self._process_message, msg)
+                                    fut.add_done_callback(lambda _: slots.release())
+                                    pending[fut] = msg
+                                self._settle_done(receiver, pending, receive_and_delete)
+                            except KeyboardInterrupt:
+                                LOG.info("Interrupted, stopping listener")
+                                break
+                            except Exception:
+                                LOG.exception("Error while receiving messages, continuing")
+                    finally:
+                        # let in-flight jobs finish and settle them while the receiver is still open
+                        pool.shutdown(wait=True)
+                        self._settle_done(receiver, pending, receive_and_delete)
+                        if renewer is not None:
+                            renewer.close()
+                        if timeout_details is not None:
+                            # send a warning to the output queue with basic orchestrator info,
+                            # after the summaries of every job that was still running
+                            self._send_warning_summary("listen_timeout", details=timeout_details)
+        finally:
+            # drain buffered summaries, then release the senders/clients cached while listening
+            self.flush_summaries()
+            self.close_senders()
 
 
 def main_from_env():
@@ -256,6 +458,10 @@ def main_from_env():
     parser.add_argument("--connection-string", required=False, help="Service Bus connection string (overrides env SERVICEBUS_CONNECTION_STRING)")
     parser.add_argument("--sb-fqdn", required=False, help="Service Bus fully-qualified namespace to use managed identity (overrides env SB_FQDN)")
     parser.add_argument("--listen-duration", required=False, type=int, help="How many seconds to listen before stopping and sending a warning summary (overrides env LISTEN_DURATION_SECONDS)")
+    parser.add_argument("--max-workers", required=False, type=int, help="How many messages to process concurrently (overrides env MAX_WORKERS, default 4)")
+    parser.add_argument("--prefetch-count", required=False, type=int, default=0, help="Messages to prefetch into the receiver (default 0). Prefetched messages are not lock-renewed while buffered, so keep this at most --max-workers and only raise it for jobs that finish well within the lock duration")
+    parser.add_argument("--batch-size", required=False, type=int, help="Maximum messages per receive call (default: --max-workers)")
+    parser.add_argument("--receive-and-delete", action="store_true", help="Use RECEIVE_AND_DELETE mode: skip settlement, failed messages are not retried")
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
@@ -264,8 +470,14 @@ def main_from_env():
         input_queue=args.input_queue,
         output_queue=args.output_queue,
         sb_fqdn=args.sb_fqdn,
+        max_workers=args.max_workers,
+    )
+    orchestrator.listen_queue(
+        listen_duration_seconds=args.listen_duration,
+        prefetch_count=args.prefetch_count,
+        batch_size=args.batch_size,
+        receive_and_delete=args.receive_and_delete,
     )
-    orchestrator.listen_queue(listen_duration_seconds=args.listen_duration)
 
 
 if __name__ == "__main__":
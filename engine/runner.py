@@ -1,13 +1,35 @@
 
 from __future__ import annotations
-import argparse, yaml, json, time
-from typing import Dict, Any, List, Optional, Tuple
-import jmespath
+import argparse, os, threading, yaml, json, time
+import orjson
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Any, List, Optional, Tuple
+from jmespath.exceptions import JMESPathError
 from lxml import etree
-from .config import AppConfig, SourceConfig
-from .http_client import send
-from .mapping import map_json, map_xml
-from .sinks import write_records
+from .config import AppConfig, ResponseField, ResponseSpec, SourceConfig
+from .http_client import fetch_stream
+from .mapping import StreamMappingError, compile_jmes, compile_xpath, map_json, map_xml, map_xml_tree, parse_xml, stream_mapper
+from .sinks import SinkWriter
+try:
+    # libyaml bindings parse configs several times faster than the pure-Python loader
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # pragma: no cover - PyYAML built without libyaml
+    from yaml import SafeLoader as _YamlLoader
+
+# Sink paths are fixed per config, so concurrent runs (e.g. orchestrator
+# workers) of the same source would truncate and interleave one file. Runs
+# writing the same sink path hold its lock for their whole duration.
+_SINK_LOCKS: Dict[str, threading.Lock] = {}
+_SINK_LOCKS_GUARD = threading.Lock()
+
+def _sink_lock(path: str) -> threading.Lock:
+    key = os.path.abspath(path)
+    with _SINK_LOCKS_GUARD:
+        lock = _SINK_LOCKS.get(key)
+        if lock is None:
+            lock = _SINK_LOCKS[key] = threading.Lock()
+        return lock
 
 def run(config_path: str, mls: int, context: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
     """Run ingestion and return (total_records, metadata).
@@ -17,145 +39,209 @@ def run(config_path: str, mls: int, context: Dict[str, Any]) -> Tuple[int, Dict[
       - sample (first record fields, if any)
     """
     with open(config_path, "r", encoding="utf-8") as f:
-        raw = yaml.safe_load(f)
+        raw = yaml.load(f, Loader=_YamlLoader)
     app = AppConfig(**raw)
 
     src = _get_source(app, mls)
+    # create the sink directory once here rather than on every page write
+    os.makedirs(os.path.dirname(src.sink.path) or ".", exist_ok=True)
+    sender = src.make_sender()
     total = 0
     sample: Optional[Dict[str, Any]] = None
-    last_resp = None
+    response_fields: Optional[Dict[str, Any]] = None
     start = time.time()
 
-    # basic pagination loop (page-based)
-    if src.paginate and src.paginate.get("type") == "page":
-        page = int(src.paginate.get("start", 1))
-        max_pages = int(src.paginate.get("max_pages", 1))
-        while page <= max_pages:
-            ctx = {**context, "page": page}
-            recs, resp = _fetch_once(src, ctx)
-            last_resp = resp
-            if not recs:
-                break
-            if sample is None and len(recs) > 0:
+    # One sink handle for the whole run; the configured mode applies when it
+    # is opened and every later page is appended through it. Mapped records
+    # carry exactly the mapping's fields, so those are the CSV columns.
+    fieldnames = [f.name for f in src.mapping.fields]
+    with _sink_lock(src.sink.path), SinkWriter(src.sink.type, src.sink.path, src.sink.mode, fieldnames) as writer:
+        # basic pagination loop (page-based)
+        if src.paginate and src.paginate.get("type") == "page":
+            page = int(src.paginate.get("start", 1))
+            max_pages = int(src.paginate.get("max_pages", 1))
+            concurrency = max(1, int(src.paginate.get("concurrency", 8)))
+            # Keep a sliding window of pages in flight. Results are consumed in page
+            # order on this thread, so the sink is written exactly as a sequential
+            # fetch would write it.
+            pool = ThreadPoolExecutor(max_workers=concurrency)
+            inflight: Deque[Future] = deque()
+            # Each page gets its own context dict: pages render on worker threads,
+            # so one shared dict mutated per page would race (and Jinja copies
+            # the context on every render anyway).
+            next_page = page
+            try:
+                while page <= max_pages:
+                    if not inflight:
+                        inflight.append(pool.submit(_fetch_once, src, {**context, "page": next_page}, sender))
+                        next_page += 1
+                    recs, response_fields = inflight.popleft().result()
+                    if not recs:
+                        break
+                    # top the window up before writing so the next pages are
+                    # already on the wire while this one hits the sink
+                    while next_page <= max_pages and len(inflight) < concurrency:
+                        inflight.append(pool.submit(_fetch_once, src, {**context, "page": next_page}, sender))
+                        next_page += 1
+                    if sample is None and len(recs) > 0:
+                        sample = recs[0]
+                    writer.write(recs)
+                    total += len(recs)
+                    page += 1
+                    # backoff if configured?
+            finally:
+                # pages past an empty (or failed) one are not needed
+                pool.shutdown(wait=True, cancel_futures=True)
+        else:
+            recs, response_fields = _fetch_once(src, context, sender)
+            if recs and len(recs) > 0:
                 sample = recs[0]
-            write_records(recs, src.sink.type, src.sink.path, "append" if (page > 1 and src.sink.mode=="overwrite") else src.sink.mode)
-            total += len(recs)
-            page += 1
-            # backoff if configured?
-    else:
-        recs, resp = _fetch_once(src, context)
-        last_resp = resp
-        if recs and len(recs) > 0:
-            sample = recs[0]
-        write_records(recs, src.sink.type, src.sink.path, src.sink.mode)
-        total = len(recs)
+            writer.write(recs)
+            total = len(recs)
 
     elapsed = time.time() - start
     metadata = {
         "elapsed_seconds": elapsed,
         "sample": sample,
     }
-    # If configured, extract response-level fields from the last HTTP response
-    try:
-        if getattr(src, "response", None) and last_resp is not None:
-            metadata["response_fields"] = _extract_response_fields(last_resp, src.response)
-    except Exception:
-        # don't fail the run due to response extraction errors
-        pass
+    # If configured, the response-level fields of the last HTTP response
+    if response_fields is not None:
+        metadata["response_fields"] = response_fields
     return total, metadata
 
 
-def _extract_response_fields(resp: Any, response_spec) -> Dict[str, Any]:
-    out: Dict[str, Any] = {}
-    json_doc: Optional[Any] = None
-    xml_root = None
-    nsmap = None
+def _response_status(resp: Any, parsed_doc: Any, fields: List[ResponseField], out: Dict[str, Any]) -> None:
+    status = getattr(resp, "status_code", None)
+    for f in fields:
+        out[f.name] = status
 
-    for f in response_spec.fields:
-        src = getattr(f, "source", "json")
-        expr = getattr(f, "expr", None)
-        if src == "status":
-            out[f.name] = getattr(resp, "status_code", None)
-        elif src == "header":
-            # headers are case-insensitive
-            try:
-                headers = {k.lower(): v for k, v in dict(resp.headers).items()}
-                out[f.name] = headers.get((expr or "").lower())
-            except Exception:
-                out[f.name] = None
-        elif src == "json":
-            if json_doc is None:
-                try:
-                    json_doc = resp.json()
-                except Exception:
-                    json_doc = None
-            if json_doc is None or not expr:
-                out[f.name] = None
-            else:
-                try:
-                    out[f.name] = jmespath.search(expr, json_doc)
-                except Exception:
-                    out[f.name] = None
-        elif src == "xml":
-            if xml_root is None:
-                try:
-                    xml_root = etree.fromstring(resp.content)
-                    nsmap = xml_root.nsmap
-                except Exception:
-                    xml_root = None
-            if xml_root is None or not expr:
+def _response_header(resp: Any, parsed_doc: Any, fields: List[ResponseField], out: Dict[str, Any]) -> None:
+    # httpx.Headers is already case-insensitive, so look names up directly
+    headers = resp.headers
+    for f in fields:
+        if f.expr:
+            out[f.name] = headers.get(f.expr)
+
+def _response_json(resp: Any, parsed_doc: Any, fields: List[ResponseField], out: Dict[str, Any]) -> None:
+    if parsed_doc is not None and not etree.iselement(parsed_doc):
+        json_doc = parsed_doc
+    else:
+        try:
+            json_doc = orjson.loads(resp.content)
+        except ValueError:
+            return
+    for f in fields:
+        if not f.expr:
+            continue
+        try:
+            # compiled once per expression, shared across pages and runs
+            out[f.name] = compile_jmes(f.expr).search(json_doc)
+        except JMESPathError:
+            pass
+
+def _response_xml(resp: Any, parsed_doc: Any, fields: List[ResponseField], out: Dict[str, Any]) -> None:
+    if etree.iselement(parsed_doc):
+        xml_root = parsed_doc
+    else:
+        try:
+            xml_root = parse_xml(resp.content)
+        except (etree.XMLSyntaxError, ValueError):
+            return
+    ns = frozenset(xml_root.nsmap.items())
+    for f in fields:
+        if not f.expr:
+            continue
+        try:
+            val = compile_xpath(f.expr, ns)(xml_root)
+        except (etree.XPathError, TypeError):
+            continue
+        if isinstance(val, list):
+            if len(val) == 0:
                 out[f.name] = None
+            elif len(val) == 1:
+                v = val[0]
+                out[f.name] = v.text if hasattr(v, "text") else v
             else:
-                try:
-                    val = xml_root.xpath(expr, namespaces=nsmap)
-                    if isinstance(val, list):
-                        if len(val) == 0:
-                            out[f.name] = None
-                        elif len(val) == 1:
-                            v = val[0]
-                            out[f.name] = v.text if hasattr(v, "text") else v
-                        else:
-                            out[f.name] = [ (v.text if hasattr(v, "text") else v) for v in val ]
-                    else:
-                        out[f.name] = val
-                except Exception:
-                    out[f.name] = None
+                out[f.name] = [ (v.text if hasattr(v, "text") else v) for v in val ]
         else:
-            out[f.name] = None
+            out[f.name] = val
+
+_RESPONSE_DISPATCH = {
+    "status": _response_status,
+    "header": _response_header,
+    "json": _response_json,
+    "xml": _response_xml,
+}
 
+def _extract_response_fields(resp: Any, response_spec: ResponseSpec, parsed_doc: Any = None) -> Dict[str, Any]:
+    """Extract response-level fields from resp.
+
+    parsed_doc is the body as already parsed by _fetch_page (a JSON value or
+    an lxml root element); it is reused instead of parsing the body again.
+    Fields that cannot be extracted are None.
+    """
+    # pre-filled so the output keeps the configured field order
+    out: Dict[str, Any] = {f.name: None for f in response_spec.fields}
+    groups: Dict[str, List[ResponseField]] = {}
+    for f in response_spec.fields:
+        groups.setdefault(f.source, []).append(f)
+    # each handler parses/normalizes what it needs once for its whole group
+    for source, fields in groups.items():
+        handler = _RESPONSE_DISPATCH.get(source)
+        if handler is not None:
+            handler(resp, parsed_doc, fields, out)
     return out
 
-def _fetch_once(src: SourceConfig, context: Dict[str, Any]) -> Tuple[List[Dict[str,Any]], Any]:
-    resp = send(src.request, src.auth, context)
+def _stream_mapper(src: SourceConfig):
+    # Response fields read from the body need the whole document, so don't stream then
+    if src.response and any(f.source in ("json", "xml") for f in src.response.fields):
+        return None
+    return stream_mapper(src.mapping, src.input_format)
+
+def _fetch_once(src: SourceConfig, context: Dict[str, Any], sender: Callable[[Dict[str, Any]], Any]) -> Tuple[List[Dict[str,Any]], Optional[Dict[str, Any]]]:
+    """Fetch and map one page; returns (records, response fields or None)."""
+    recs, resp, doc = _fetch_page(src, context, sender)
+    if not src.response:
+        return recs, None
+    # Reduce the response to its configured fields right away so neither the
+    # response nor its parsed body outlives the page.
+    try:
+        return recs, _extract_response_fields(resp, src.response, doc)
+    except Exception:
+        # don't fail the run due to response extraction errors
+        return recs, None
+
+def _fetch_page(src: SourceConfig, context: Dict[str, Any], sender: Callable[[Dict[str, Any]], Any]) -> Tuple[List[Dict[str,Any]], Any, Any]:
+    """Fetch and map one page; returns (records, response, parsed body or None)."""
+    mapper = _stream_mapper(src)
+    if mapper is not None:
+        # map records as body chunks arrive instead of materializing the full body
+        try:
+            recs, resp = fetch_stream(src.request, src.auth, context, mapper)
+            return recs, resp, None
+        except StreamMappingError:
+            # the streaming parser rejected the body; fetch the page again and
+            # parse it whole below, which either succeeds or fails as it would
+            # without streaming
+            pass
+    resp = sender(context)
     resp.raise_for_status()
     if src.input_format == "json":
-        doc = resp.json()
-        return map_json(doc, src.mapping), resp
-    else:
-        content = resp.content
-        return map_xml(content, src.mapping), resp
+        # orjson parses the raw body bytes directly, skipping the text decode
+        doc = orjson.loads(resp.content)
+        return map_json(doc, src.mapping), resp, doc
+    if src.response and any(f.source == "xml" for f in src.response.fields):
+        # keep the tree so response fields don't parse the body a second time
+        root = parse_xml(resp.content)
+        return map_xml_tree(root, src.mapping), resp, root
+    return map_xml(resp.content, src.mapping), resp, None
 
 def _get_source(app: AppConfig, mls: int) -> SourceConfig:
-    # 1) exact match
-    for s in app.sources:
-        if s.mls_id == mls:
-            return s
-
-    # 2) fallback to a default source with mls_id == 0
-    for s in app.sources:
-        if getattr(s, "mls_id", None) == 0:
-            return s
-
-    # 3) fallback to a source explicitly named 'default' (case-insensitive)
-    for s in app.sources:
-        if getattr(s, "name", "").lower() == "default":
-            return s
-
-    # 4) final fallback: return the first source (best-effort)
-    if app.sources:
-        return app.sources[0]
-
-    raise SystemExit(f"No source found for MLS {mls}")
+    # exact match, else the fallback resolved when the config was loaded
+    src = app.source_for(mls)
+    if src is None:
+        raise SystemExit(f"No source found for MLS {mls}")
+    return src
 
 if __name__ == "__main__":
     p = argparse.ArgumentParser()
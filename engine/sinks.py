@@ -1,28 +1,86 @@
 
 from __future__ import annotations
-from typing import List, Dict, Any
-import os, csv, json
-import pandas as pd
+from typing import IO, Callable, List, Dict, Any, Optional, Sequence
+import functools, os, csv
+import orjson
+
+_SINK_TYPES = ("ndjson", "csv")
+
+# Sink files sit on a BufferedWriter this large (text-mode files included, as
+# TextIOWrapper writes through to one), so a page of records reaches the OS in
+# a handful of write() calls.
+SINK_BUFFER_BYTES = 4 * 1024 * 1024
+
+class SinkWriter:
+    """Writes the record batches of one run through a single open file.
+
+    The file is opened on the first non-empty batch using the configured mode
+    (overwrite truncates, append adds to an existing file); every later batch
+    goes to the same handle. Use as a context manager or call close().
+    The parent directory must already exist.
+
+    fieldnames fixes the CSV columns (e.g. the mapping's field names); without
+    it they are taken from the first batch.
+    """
+
+    def __init__(self, sink_type: str, path: str, mode: str = "overwrite", fieldnames: Optional[Sequence[str]] = None):
+        if sink_type not in _SINK_TYPES:
+            raise ValueError(f"Unsupported sink type: {sink_type}")
+        self.sink_type = sink_type
+        self.path = path
+        self.mode = mode
+        self.fieldnames = list(dict.fromkeys(fieldnames)) if fieldnames else None
+        self._f: Optional[IO] = None
+        # Format and file mode are resolved once: the first write opens the
+        # file and rebinds this to the writer for it.
+        self._write: Callable[[List[Dict[str, Any]]], None] = self._open_and_write
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        if records:
+            self._write(records)
+
+    def _open_and_write(self, records: List[Dict[str, Any]]) -> None:
+        self._open(records)
+        self._write(records)
+
+    def _open(self, records: List[Dict[str, Any]]) -> None:
+        write_mode = "w" if self.mode == "overwrite" else "a"
+        if self.sink_type == "ndjson":
+            # orjson emits UTF-8 bytes directly, so no str -> bytes encode on write
+            self._f = open(self.path, write_mode + "b", buffering=SINK_BUFFER_BYTES)
+            self._write = functools.partial(_write_ndjson, self._f)
+            return
+        header = not (self.mode == "append" and os.path.exists(self.path))
+        self._f = open(self.path, write_mode, encoding="utf-8", newline="", buffering=SINK_BUFFER_BYTES)
+        fieldnames = self.fieldnames
+        if fieldnames is None:
+            # the union of the first batch's record keys, in first-seen order
+            fieldnames = list(dict.fromkeys(k for r in records for k in r))
+        writer = csv.DictWriter(self._f, fieldnames=fieldnames, lineterminator="\n", extrasaction="ignore")
+        if header:
+            writer.writeheader()
+        self._write = writer.writerows
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+            self._write = self._open_and_write
+
+    def __enter__(self) -> "SinkWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
 
 def write_records(records: List[Dict[str, Any]], sink_type: str, path: str, mode: str = "overwrite"):
+    # one-shot write: unlike run(), nothing has created the directory yet
     if not records:
         return
     os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-    if sink_type == "ndjson":
-        _write_ndjson(records, path, mode)
-    elif sink_type == "csv":
-        _write_csv(records, path, mode)
-    else:
-        raise ValueError(f"Unsupported sink type: {sink_type}")
-
-def _write_ndjson(records, path, mode):
-    write_mode = "w" if mode == "overwrite" else "a"
-    with open(path, write_mode, encoding="utf-8") as f:
-        for r in records:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
-
-def _write_csv(records, path, mode):
-    df = pd.DataFrame(records)
-    write_mode = "w" if mode == "overwrite" else "a"
-    header = not (mode == "append" and os.path.exists(path))
-    df.to_csv(path, index=False, mode=write_mode, header=header)
+    with SinkWriter(sink_type, path, mode) as writer:
+        writer.write(records)
+
+def _write_ndjson(f: IO, records: List[Dict[str, Any]]) -> None:
+    # serialize the whole batch up front and hand it to the file in one write
+    f.write(b"\n".join([orjson.dumps(r) for r in records]) + b"\n")